@@ -10,3 +10,10 @@ BOT_USERNAME = os.getenv("BOT_USERNAME", "DareGushi_BOT")
 BOT_NAME_FA = os.getenv("BOT_NAME_FA", "درگوشی")
 
 READ_LIMIT_MINUTES = int(os.getenv("PENDING_TIMEOUT_MINUTES", "5"))
+
+# connection pool; the broadcast and report fan-outs run many handlers at once
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds; replace connections before server/proxy idle cutoffs
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))  # asyncpg prepared statements per connection
+DB_STATEMENT_TIMEOUT = float(os.getenv("DB_STATEMENT_TIMEOUT", "10"))  # seconds; fail a stuck query instead of queueing behind it (init_db lifts it)
@@ -1,105 +1,80 @@
 
+import asyncio
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy import text
-from .config import DATABASE_URL
+from .config import DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_STATEMENT_CACHE_SIZE, DB_STATEMENT_TIMEOUT
 
-engine = create_async_engine(DATABASE_URL, future=True, pool_pre_ping=True)
+engine = create_async_engine(
+    DATABASE_URL,
+    future=True,
+    pool_pre_ping=True,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_recycle=DB_POOL_RECYCLE,
+    connect_args={
+        "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+        # only short point queries here: JIT never pays off; the name makes our sessions easy to spot.
+        # The timeout is server-side so init_db can lift it for its own transaction.
+        "server_settings": {
+            "jit": "off",
+            "application_name": "najva-bot",
+            "statement_timeout": str(int(DB_STATEMENT_TIMEOUT * 1000)),
+        },
+    },
+)
 SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
 
 class Base(DeclarativeBase):
     pass
 
-async def _table_exists(conn, table_name: str) -> bool:
+async def _column_collation(conn, table: str, column: str) -> str | None:
     q = text("""
-        SELECT EXISTS (
-            SELECT 1 FROM information_schema.tables
-            WHERE table_schema = 'public' AND table_name = :t
-        ) AS ok
+        SELECT collation_name FROM information_schema.columns
+        WHERE table_schema='public' AND table_name=:t AND column_name=:c
     """)
-    res = await conn.execute(q, {"t": table_name})
-    return bool(res.scalar())
-
-async def _has_columns(conn, table: str, cols: list[str]) -> bool:
-    q = text("""
-        SELECT column_name FROM information_schema.columns
-        WHERE table_schema='public' AND table_name=:t
-    """)
-    res = await conn.execute(q, {"t": table})
-    have = {r[0] for r in res}
-    return all(c in have for c in cols)
+    res = await conn.execute(q, {"t": table, "c": column})
+    return res.scalar()
 
 async def _safe_exec(conn, sql: str):
+    # best-effort step: the savepoint keeps a failure here from aborting the surrounding init transaction
     try:
-        await conn.execute(text(sql))
+        async with conn.begin_nested():
+            await conn.execute(text(sql))
     except Exception:
         pass
 
+async def close_db():
+    await engine.dispose()
+
+async def warm_pool():
+    # open the whole pool up front so the first burst of updates doesn't wait on connects
+    async def ping():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+    await asyncio.gather(*(ping() for _ in range(DB_POOL_SIZE)))
+
 async def init_db():
-    from .models import User, Group, Whisper, Pending, Watch  # noqa
+    from .models import User, Group, Whisper, Pending, Watch, WHISPER_TOKEN_SQL  # noqa
     async with engine.begin() as conn:
-        # create dg_* tables if not exist
+        # one-shot schema/migration work: don't wait on a WAL flush; a crash here just reruns it
+        await conn.execute(text("SET LOCAL synchronous_commit = off"))
+        # table rewrites below (e.g. the whispers.id collation change) can outlast the request-path timeout
+        await conn.execute(text("SET LOCAL statement_timeout = 0"))
+        # create tables if not exist
         await conn.run_sync(Base.metadata.create_all)
-
-        legacy = ["users", "groups", "whispers", "pendings", "watches"]
-        any_legacy = False
-        for t in legacy:
-            if await _table_exists(conn, t):
-                any_legacy = True
-                break
-
-        if any_legacy:
-            # users -> dg_users
-            if await _table_exists(conn, "users"):
-                if await _has_columns(conn, "users", ["id", "first_name", "username", "is_blocked", "joined_at"]):
-                    await _safe_exec(conn, """
-                        INSERT INTO dg_users(id, first_name, username, is_blocked, joined_at)
-                        SELECT id, first_name, username, COALESCE(is_blocked,false), COALESCE(joined_at, NOW())
-                        FROM users
-                        ON CONFLICT (id) DO NOTHING
-                    """)
-                await _safe_exec(conn, "DROP TABLE IF EXISTS users CASCADE;")
-
-            # groups -> dg_groups
-            if await _table_exists(conn, "groups"):
-                if await _has_columns(conn, "groups", ["id", "title", "active", "last_seen"]):
-                    await _safe_exec(conn, """
-                        INSERT INTO dg_groups(id, title, active, last_seen)
-                        SELECT id, title, COALESCE(active, true), COALESCE(last_seen, NOW())
-                        FROM groups
-                        ON CONFLICT (id) DO NOTHING
-                    """)
-                await _safe_exec(conn, "DROP TABLE IF EXISTS groups CASCADE;")
-
-            # whispers -> dg_whispers
-            if await _table_exists(conn, "whispers"):
-                if await _has_columns(conn, "whispers", ["id", "group_id", "sender_id", "recipient_id", "text", "created_at", "read_at", "group_message_id"]):
-                    await _safe_exec(conn, """
-                        INSERT INTO dg_whispers(id, group_id, sender_id, recipient_id, text, created_at, read_at, group_message_id)
-                        SELECT id, group_id, sender_id, recipient_id, text, COALESCE(created_at,NOW()), read_at, group_message_id
-                        FROM whispers
-                        ON CONFLICT (id) DO NOTHING
-                    """)
-                await _safe_exec(conn, "DROP TABLE IF EXISTS whispers CASCADE;")
-
-            # pendings -> dg_pendings
-            if await _table_exists(conn, "pendings"):
-                if await _has_columns(conn, "pendings", ["sender_id", "recipient_id", "group_id", "created_at"]):
-                    await _safe_exec(conn, """
-                        INSERT INTO dg_pendings(sender_id, recipient_id, group_id, created_at)
-                        SELECT sender_id, recipient_id, group_id, COALESCE(created_at,NOW())
-                        FROM pendings
-                        ON CONFLICT (sender_id) DO NOTHING
-                    """)
-                await _safe_exec(conn, "DROP TABLE IF EXISTS pendings CASCADE;")
-
-            # watches -> dg_watches
-            if await _table_exists(conn, "watches"):
-                if await _has_columns(conn, "watches", ["id", "group_id", "user_id"]):
-                    await _safe_exec(conn, """
-                        INSERT INTO dg_watches(id, group_id, user_id)
-                        SELECT id, group_id, user_id
-                        FROM watches
-                        ON CONFLICT (id) DO NOTHING
-                    """)
-                await _safe_exec(conn, "DROP TABLE IF EXISTS watches CASCADE;")
+        # create_all never alters existing tables; make sure older whispers tables generate tokens too
+        await _safe_exec(conn, f"ALTER TABLE whispers ALTER COLUMN id SET DEFAULT {WHISPER_TOKEN_SQL};")
+        # tokens are opaque: byte-wise "C" comparisons are cheaper than locale-aware ones
+        if await _column_collation(conn, "whispers", "id") != "C":
+            await _safe_exec(conn, 'ALTER TABLE whispers ALTER COLUMN id TYPE VARCHAR(64) COLLATE "C";')
+        await _safe_exec(conn, "CREATE INDEX IF NOT EXISTS ix_groups_active ON groups (id) WHERE active;")
+        # drop duplicate watches left by older versions, then let the unique index replace the plain one.
+        # open_watch's ON CONFLICT needs this index, so these two must not fail silently: a failure stops startup
+        await conn.execute(text("""
+            DELETE FROM watches a USING watches b
+            WHERE a.group_id = b.group_id AND a.user_id = b.user_id AND a.id > b.id
+        """))
+        await conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ux_watches_group_user ON watches (group_id, user_id);"))
+        await _safe_exec(conn, "DROP INDEX IF EXISTS ix_watches_group_user;")
+        await _safe_exec(conn, "ALTER TABLE pendings SET UNLOGGED;")
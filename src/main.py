@@ -1,62 +1,190 @@
 import asyncio
+import html
 import json
+import logging
 import re
-import secrets
 from datetime import datetime, timedelta
 from aiogram import Bot, Dispatcher, F
-from aiogram.types import Update, Message, ChatMemberUpdated
+from aiogram.types import Update, Message, ChatMemberUpdated, ErrorEvent
 from aiogram.filters import CommandStart
-from aiogram.exceptions import TelegramBadRequest
-from sqlalchemy import select, delete
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiolimiter import AsyncLimiter
+from sqlalchemy import select, delete, update, insert, literal, true, or_, func, BigInteger, Text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 from .config import BOT_TOKEN, ADMIN_ID, FORCE_CHANNEL, BOT_USERNAME, BOT_NAME_FA, READ_LIMIT_MINUTES
-from .database import init_db, SessionLocal
+from .database import init_db, warm_pool, close_db, SessionLocal
 from .models import User, Group, Whisper, Pending, Watch
-from .utils import start_keyboard, whisper_button, is_trigger
+from .utils import start_keyboard, whisper_button, is_trigger, esc, mention, command_in, TTLCache
 
 if not BOT_TOKEN:
     raise RuntimeError("BOT_TOKEN is required")
 
+logger = logging.getLogger(__name__)
+
 bot = Bot(BOT_TOKEN, parse_mode="HTML")
 dp = Dispatcher()
 
 # ---------- Helpers ----------
+# ids already written to the DB; lets ensure_user/ensure_group skip a session per message
+_seen_users = TTLCache(ttl=3600, maxsize=100_000)
+_seen_groups = TTLCache(ttl=3600)  # chat_id -> last stored title
+_MISSING = object()
+# user_id -> FORCE_CHANNEL membership; non-members are re-checked after a few seconds so joining takes effect quickly
+_members = TTLCache(ttl=60, maxsize=100_000)
+# whispers are shown in a callback alert, which Telegram caps at 200 characters
+WHISPER_MAX_LEN = 200
+# token -> Whisper, only once read: nothing about it changes after that
+_read_whispers = TTLCache(ttl=7200)
+# group_id -> report recipients; dropped by open_watch/close_watch, TTL covers edits made elsewhere
+_watchers_cache = TTLCache(ttl=60)
+# keep fan-out below Telegram's ~30 msg/s global limit: bounded concurrency, paced by a token bucket
+_send_limit = asyncio.Semaphore(25)
+BROADCAST_WORKERS = 25  # enough to keep every _send_limit slot busy
+BROADCAST_PAGE = 1000
+_send_rate = AsyncLimiter(25, 1)
+
+async def _bounded(send, *args):
+    async with _send_limit:
+        while True:
+            async with _send_rate:
+                try:
+                    return await send(*args)
+                except TelegramRetryAfter as e:
+                    retry = e.retry_after
+            await asyncio.sleep(retry)
+
+# hidden reports get a smaller share so a heavily watched group can't crowd out user-facing replies
+_report_rate = AsyncLimiter(10, 1)
+
+# running report fan-outs; the loop only keeps weak references to tasks
+_report_tasks: set[asyncio.Task] = set()
+
+async def _send_report(uid: int, text: str):
+    async with _report_rate:
+        return await _bounded(bot.send_message, uid, text)
+
 async def is_member(user_id: int) -> bool:
+    ok = _members.get(user_id)
+    if ok is not None:
+        return ok
     try:
         member = await bot.get_chat_member(FORCE_CHANNEL, user_id)
         status = getattr(member, 'status', None)
-        return status in {'member', 'administrator', 'creator', 'owner'}
+        ok = status in {'member', 'administrator', 'creator', 'owner'}
     except Exception:
-        return False
+        return False  # API trouble is not an answer; don't cache it
+    _members.set(user_id, ok, ttl=None if ok else 5)
+    return ok
+
+async def _store_users(s, users):
+    # one INSERT ... ON CONFLICT DO NOTHING for all of them; the caller commits and then marks the ids as seen
+    rows = {u.id: {"id": u.id, "first_name": u.first_name, "username": u.username} for u in users}
+    if rows:
+        await s.execute(pg_insert(User).on_conflict_do_nothing(index_elements=[User.id]), list(rows.values()))
 
 async def ensure_user(user):
+    if _seen_users.get(user.id):
+        return
     async with SessionLocal() as s:
-        u = await s.get(User, user.id)
-        if not u:
-            u = User(id=user.id, first_name=user.first_name, username=user.username)
-            s.add(u)
-            await s.commit()
-        return u
+        await _store_users(s, [user])
+        await s.commit()
+    _seen_users.set(user.id, True)
 
 async def ensure_group(chat):
+    title = chat.title if hasattr(chat, 'title') else None
+    if _seen_groups.get(chat.id, _MISSING) == title:
+        return
+    # one upsert; the WHERE keeps a known, active, same-titled group from writing a new row version
+    stmt = pg_insert(Group).values(id=chat.id, title=title, active=True, last_seen=datetime.utcnow())
+    new_title = func.coalesce(stmt.excluded.title, Group.title)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Group.id],
+        set_={"title": new_title, "active": True, "last_seen": stmt.excluded.last_seen},
+        where=or_(Group.title.is_distinct_from(new_title), Group.active.is_(False)),
+    )
     async with SessionLocal() as s:
-        g = await s.get(Group, chat.id)
-        title = chat.title if hasattr(chat, 'title') else None
-        if not g:
-            g = Group(id=chat.id, title=title, active=True)
-            s.add(g)
-        else:
-            g.title = title or g.title
-            g.active = True
+        await s.execute(stmt)
         await s.commit()
-        return g
+    _seen_groups.set(chat.id, title)
+
+async def deactivate_group(chat_id: int):
+    async with SessionLocal() as s:
+        await s.execute(update(Group).where(Group.id == chat_id).values(active=False))
+        await s.commit()
+    _seen_groups.pop(chat_id)
+
+async def report_targets(group_id: int) -> list[int]:
+    # watchers of the group plus the admin, de-duplicated by the UNION in postgres
+    uids = _watchers_cache.get(group_id)
+    if uids is None:
+        q = select(Watch.user_id).where(Watch.group_id == group_id)
+        if ADMIN_ID:
+            q = q.union(select(literal(ADMIN_ID, BigInteger)))
+        async with SessionLocal() as s:
+            uids = (await s.execute(q)).scalars().all()
+        _watchers_cache.set(group_id, uids)
+    return uids
+
+async def claim_pending(s, sender_id: int, text: str):
+    # pop the sender's pending row and store it as a whisper in a single statement, so two quick
+    # messages can't both claim it. No row: nothing was pending; row with id None: it had expired.
+    # The stored recipient name and group title come back too, so callers needn't ask Telegram.
+    cutoff = datetime.utcnow() - timedelta(minutes=READ_LIMIT_MINUTES)
+    popped = (delete(Pending).where(Pending.sender_id == sender_id)
+              .returning(Pending.recipient_id, Pending.group_id, Pending.created_at)
+              .cte("popped"))
+    stored = (insert(Whisper)
+              .from_select(["group_id", "sender_id", "recipient_id", "text"],
+                           select(popped.c.group_id, literal(sender_id, BigInteger), popped.c.recipient_id,
+                                  literal(text, Text))
+                           .where(popped.c.created_at >= cutoff))
+              .returning(Whisper.id)
+              .cte("stored"))
+    res = await s.execute(
+        select(popped.c.recipient_id, popped.c.group_id, stored.c.id,
+               User.first_name.label("recipient_name"), Group.title.label("group_title"))
+        .select_from(popped.outerjoin(stored, true())
+                     .outerjoin(User, User.id == popped.c.recipient_id)
+                     .outerjoin(Group, Group.id == popped.c.group_id))
+    )
+    return res.first()
+
+# what open_whisper needs, as plain rows: no created_at, no ORM instance state to keep in _read_whispers
+WHISPER_VIEW = (Whisper.id, Whisper.group_id, Whisper.sender_id, Whisper.recipient_id,
+                Whisper.text, Whisper.read_at, Whisper.group_message_id)
+
+def can_read(user_id: int, w) -> bool:
+    # recipient first: they tap far more often than the sender; plain compares build no tuple
+    return user_id == w.recipient_id or user_id == w.sender_id
+
+SWEEP_BATCH = 5000
+
+async def sweep_pendings():
+    # expired pendings are dropped here in the background instead of piling up until their sender returns
+    while True:
+        await asyncio.sleep(60)
+        try:
+            cutoff = datetime.utcnow() - timedelta(minutes=READ_LIMIT_MINUTES)
+            # small batches keep each transaction's locks short; rows being claimed right now are skipped
+            batch = (select(Pending.sender_id).where(Pending.created_at < cutoff)
+                     .limit(SWEEP_BATCH).with_for_update(skip_locked=True).scalar_subquery())
+            async with SessionLocal() as s:
+                while True:
+                    res = await s.execute(delete(Pending).where(Pending.sender_id.in_(batch)))
+                    await s.commit()
+                    if res.rowcount < SWEEP_BATCH:
+                        break
+        except Exception:
+            logger.exception("pending sweep failed")
 
 # ---------- Handlers ----------
 @dp.message(CommandStart())
 async def start(message: Message):
-    await ensure_user(message.from_user)
-    if not await is_member(message.from_user.id):
-        txt = (f"سلام {message.from_user.first_name}!\n"
+    # the DB write and the channel-membership RPC are independent; overlap them
+    _, member = await asyncio.gather(ensure_user(message.from_user), is_member(message.from_user.id))
+    if not member:
+        txt = (f"سلام {esc(message.from_user.first_name)}!\n"
                f"برای استفاده از ربات، ابتدا عضو کانال زیر شوید و سپس دکمه «تایید عضویت» را بزنید:\n"
                f"{FORCE_CHANNEL}")
         await message.answer(txt, reply_markup=start_keyboard(force=True))
@@ -70,9 +198,10 @@ async def start(message: Message):
 
 @dp.callback_query(F.data == "check_sub")
 async def check_sub(call):
+    _members.pop(call.from_user.id)  # the user says they just joined: ask Telegram again
     ok = await is_member(call.from_user.id)
     if ok:
-        await call.message.edit_text("✅ عضویت شما تایید شد. از دکمه‌های زیر استفاده کنید.", reply_markup=start_keyboard(False))
+        await call.message.edit_text("✅ عضویت شما تایید شد. از دکمه‌های زیر استفاده کنید.", reply_markup=start_keyboard(False), parse_mode=None)
     else:
         await call.answer("هنوز عضو کانال نشده‌اید.", show_alert=True)
 
@@ -80,195 +209,248 @@ async def check_sub(call):
 async def me_changed(event: ChatMemberUpdated):
     chat = event.chat
     if chat.type in ("group", "supergroup"):
-        await ensure_group(chat)
+        if event.new_chat_member.status in ("left", "kicked"):
+            await deactivate_group(chat.id)
+        else:
+            await ensure_group(chat)
 
 @dp.message(F.chat.type.in_({"group", "supergroup"}))
 async def group_listener(message: Message):
-    try:
-        await ensure_group(message.chat)
-        if message.reply_to_message and is_trigger(message.text or ""):
-            sender = message.from_user
-            recipient = message.reply_to_message.from_user
-            await ensure_user(sender)
-            await ensure_user(recipient)
+    await ensure_group(message.chat)
+    if message.reply_to_message and is_trigger(message.text or ""):
+        sender = message.from_user
+        recipient = message.reply_to_message.from_user
+        # one session for both users and the pending row instead of one per write
+        async with SessionLocal() as s:
+            await _store_users(s, [u for u in (sender, recipient) if not _seen_users.get(u.id)])
+            # a fresh trigger replaces any earlier pending of this sender and restarts its clock
+            stmt = pg_insert(Pending).values(sender_id=sender.id, recipient_id=recipient.id,
+                                             group_id=message.chat.id, created_at=datetime.utcnow())
+            await s.execute(stmt.on_conflict_do_update(
+                index_elements=[Pending.sender_id],
+                set_={"recipient_id": stmt.excluded.recipient_id, "group_id": stmt.excluded.group_id,
+                      "created_at": stmt.excluded.created_at},
+            ))
+            await s.commit()
+        for u in (sender, recipient):
+            _seen_users.set(u.id, True)
+        try:
+            text = f"لطفاً متن نجوای خود را برای <b>{esc(recipient.full_name)}</b> ارسال کنید.\nحداکثر زمان: {READ_LIMIT_MINUTES} دقیقه."
+            await bot.send_message(sender.id, text)
+        except (TelegramBadRequest, TelegramForbiddenError):
+            pass  # sender never started the bot; the group reply below still points them there
+        await message.reply("◀️ لطفاً متن نجوا را در خصوصی ربات ارسال کنید…\nحداکثر زمان: {} دقیقه.".format(READ_LIMIT_MINUTES), parse_mode=None)
+
+# -------- Admin-only (PRIVATE ONLY) --------
+# registered ahead of private_collector, which takes every other private message. The admin check is
+# part of the filter so non-admin text (e.g. a whisper reading "آمار") falls through to the collector.
+ADMIN_DM = (F.chat.type == "private", F.from_user.id == ADMIN_ID)
+
+# "... برای 1,2,3" opens/closes reports for several users in one statement
+OPEN_WATCH_RE = re.compile(r"^بازکردن گزارش\s+(\-?\d+)\s+برای\s+(\-?\d+(?:\s*,\s*\-?\d+)*)$")
+CLOSE_WATCH_RE = re.compile(r"^بستن گزارش\s+(\-?\d+)\s+برای\s+(\-?\d+(?:\s*,\s*\-?\d+)*)$")
+
+@dp.message(*ADMIN_DM, F.text.func(command_in("آمار", "stats", "/stats")))
+async def stats(message: Message):
+    # three counts in one round trip; nothing but the numbers leaves postgres
+    q = select(*(select(func.count()).select_from(m).scalar_subquery() for m in (User, Group, Whisper)))
+    async with SessionLocal() as s:
+        users, groups, wcount = (await s.execute(q)).one()
+    await message.answer(f"کاربران: {users}\nگروه‌ها: {groups}\nکل نجواها: {wcount}")
+
+@dp.message(*ADMIN_DM, F.text.regexp(OPEN_WATCH_RE).as_("m"))
+async def open_watch(message: Message, m: re.Match):
+    gid = int(m.group(1)); uids = {int(u) for u in m.group(2).split(",")}
+    async with SessionLocal() as s:
+        await s.execute(pg_insert(Watch).on_conflict_do_nothing(index_elements=[Watch.group_id, Watch.user_id]),
+                        [{"group_id": gid, "user_id": uid} for uid in uids]); await s.commit()
+    _watchers_cache.pop(gid)
+    await message.answer("فعال شد.")
+
+@dp.message(*ADMIN_DM, F.text.regexp(CLOSE_WATCH_RE).as_("m"))
+async def close_watch(message: Message, m: re.Match):
+    gid = int(m.group(1)); uids = {int(u) for u in m.group(2).split(",")}
+    async with SessionLocal() as s:
+        await s.execute(delete(Watch).where(Watch.group_id==gid, Watch.user_id.in_(uids))); await s.commit()
+    _watchers_cache.pop(gid)
+    await message.answer("غیرفعال شد.")
+
+@dp.message(*ADMIN_DM, F.text.func(command_in("ارسال همگانی", "broadcast", "فوروارد همگانی")))
+async def broadcast_hint(message: Message):
+    await message.answer("پیامی که می‌خواهید فوروارد شود را Reply کنید و جمله «تایید ارسال» را بفرستید.")
+
+async def broadcast_ids():
+    # keyset pages, each read in its own short session: a broadcast runs for minutes or hours and must
+    # not pin a connection, snapshot and cursor that long. User ids are positive and group ids negative,
+    # so no id is yielded twice.
+    for col, cond in ((User.id, true()), (Group.id, Group.active)):
+        last = None
+        while True:
+            q = select(col).where(cond).order_by(col).limit(BROADCAST_PAGE)
+            if last is not None:
+                q = q.where(col > last)
             async with SessionLocal() as s:
-                from .models import Pending
-                p = Pending(sender_id=sender.id, recipient_id=recipient.id, group_id=message.chat.id)
-                await s.merge(p)
-                await s.commit()
+                page = (await s.scalars(q)).all()
+            for cid in page:
+                yield cid
+            if len(page) < BROADCAST_PAGE:
+                break
+            last = page[-1]
+
+@dp.message(*ADMIN_DM, F.reply_to_message, F.text.func(lambda t: bool(t) and t.strip() == "تایید ارسال"))
+async def admin_private(message: Message):
+    reply = message.reply_to_message
+    # feed ids page by page into the senders: memory stays flat and the first forward goes out right away
+    ids = asyncio.Queue(maxsize=BROADCAST_PAGE)
+    sent = failed = 0
+
+    async def forwarder():
+        nonlocal sent, failed
+        while (cid := await ids.get()) is not None:
             try:
-                text = f"لطفاً متن نجوای خود را برای <b>{recipient.full_name}</b> ارسال کنید.\nحداکثر زمان: {READ_LIMIT_MINUTES} دقیقه."
-                await bot.send_message(sender.id, text)
-            except TelegramBadRequest:
-                pass
-            await message.reply("◀️ لطفاً متن نجوا را در خصوصی ربات ارسال کنید…\nحداکثر زمان: {} دقیقه.".format(READ_LIMIT_MINUTES))
-    except Exception:
-        pass
+                await _bounded(reply.forward, cid)  # FORWARD (not copy)
+                sent += 1
+            except Exception:
+                failed += 1
+
+    workers = [asyncio.create_task(forwarder()) for _ in range(BROADCAST_WORKERS)]
+    try:
+        async for cid in broadcast_ids():
+            await ids.put(cid)
+    finally:
+        for _ in workers:
+            await ids.put(None)
+        await asyncio.gather(*workers)
+    await message.answer(f"فوروارد انجام شد. موفق: {sent} | ناموفق: {failed}")
 
 @dp.message(F.chat.type == "private")
 async def private_collector(message: Message):
     if not await is_member(message.from_user.id):
-        await message.answer("برای استفاده، ابتدا عضو کانال شوید و سپس «تایید عضویت» را بزنید.", reply_markup=start_keyboard(force=True))
+        await message.answer("برای استفاده، ابتدا عضو کانال شوید و سپس «تایید عضویت» را بزنید.", reply_markup=start_keyboard(force=True), parse_mode=None)
         return
-    await ensure_user(message.from_user)
+    # validate before touching the DB: an empty or oversized message never claims the pending row
     text = message.text or (message.caption or "")
     if not text:
-        await message.answer("متن نجوا را ارسال کنید.")
+        await message.answer("متن نجوا را ارسال کنید.", parse_mode=None)
         return
-
-    from .models import Whisper, Pending, Watch
-    from sqlalchemy import select, delete
-    from datetime import datetime, timedelta
+    if len(text) > WHISPER_MAX_LEN:
+        await message.answer(f"متن نجوا حداکثر {WHISPER_MAX_LEN} کاراکتر می‌تواند باشد.", parse_mode=None)
+        return
+    await ensure_user(message.from_user)
 
     async with SessionLocal() as s:
-        q = await s.get(Pending, message.from_user.id)
-        if not q:
-            await message.answer("در گروه روی پیام مخاطب «نجوا» بزنید و سپس متن را ارسال کنید.")
-            return
-        if datetime.utcnow() - q.created_at > timedelta(minutes=READ_LIMIT_MINUTES):
-            await s.execute(delete(Pending).where(Pending.sender_id == message.from_user.id))
-            await s.commit()
-            await message.answer("مهلت ارسال به پایان رسید. دوباره در گروه «نجوا» بزنید.")
-            return
-        import secrets
-        token = secrets.token_urlsafe(16)
-        w = Whisper(id=token, group_id=q.group_id, sender_id=q.sender_id, recipient_id=q.recipient_id, text=text)
-        s.add(w)
-        await s.execute(delete(Pending).where(Pending.sender_id == message.from_user.id))
+        q = await claim_pending(s, message.from_user.id, text)
         await s.commit()
+    if not q:
+        await message.answer("در گروه روی پیام مخاطب «نجوا» بزنید و سپس متن را ارسال کنید.", parse_mode=None)
+        return
+    if q.id is None:
+        await message.answer("مهلت ارسال به پایان رسید. دوباره در گروه «نجوا» بزنید.", parse_mode=None)
+        return
+    token = q.id
+    recipient_name = q.recipient_name or "کاربر"
 
-    try:
-        recipient = await bot.get_chat(q.recipient_id)
-    except Exception:
-        recipient = type("obj",(object,),{"id":q.recipient_id,"full_name":"کاربر"})()
     try:
         group_msg = await bot.send_message(
             chat_id=q.group_id,
-            text=f"نجوا برای {recipient.full_name} ارسال شد.",
+            text=f"نجوا برای {esc(recipient_name)} ارسال شد.",
             reply_markup=whisper_button(token)
         )
         async with SessionLocal() as s:
-            wdb = await s.get(Whisper, token)
-            wdb.group_message_id = group_msg.message_id
+            await s.execute(update(Whisper).where(Whisper.id == token).values(group_message_id=group_msg.message_id))
             await s.commit()
     except TelegramBadRequest:
-        await message.answer("نجوا ثبت شد، اما ارسال پیام گروهی موفق نبود.")
-    await message.answer("نجوا ثبت و ارسال شد.")
+        await message.answer("نجوا ثبت شد، اما ارسال پیام گروهی موفق نبود.", parse_mode=None)
+    await message.answer("نجوا ثبت و ارسال شد.", parse_mode=None)
 
-    # Hidden reports
+    # Hidden reports: the sender already has their ack, don't hold the handler for the fan-out
+    task = asyncio.create_task(send_reports(message.from_user, q, recipient_name, text))
+    _report_tasks.add(task)
+    task.add_done_callback(_report_tasks.discard)
+
+async def send_reports(sender, q, recipient_name: str, text: str):
     try:
-        sender = message.from_user
-        group = await bot.get_chat(q.group_id)
-        recipient = await bot.get_chat(q.recipient_id)
+        targets = await report_targets(q.group_id)
         admin_text = (f"گزارش نجوا:\n"
-                      f"فرستنده: <a href=\"tg://user?id={sender.id}\">{sender.full_name}</a>\n"
-                      f"گروه: {group.title} ({group.id})\n"
-                      f"گیرنده: <a href=\"tg://user?id={recipient.id}\">{recipient.full_name}</a>\n"
-                      f"متن: {text}")
-        if ADMIN_ID:
-            await bot.send_message(ADMIN_ID, admin_text)
-        async with SessionLocal() as s:
-            res = await s.execute(select(Watch).where(Watch.group_id==q.group_id))
-            for wch in res.scalars():
-                try:
-                    if wch.user_id != ADMIN_ID:
-                        await bot.send_message(wch.user_id, admin_text)
-                except:
-                    pass
+                      f"فرستنده: {mention(sender.id, sender.full_name)}\n"
+                      f"گروه: {esc(q.group_title or '')} ({q.group_id})\n"
+                      f"گیرنده: {mention(q.recipient_id, recipient_name)}\n"
+                      f"متن: {html.escape(text)}")
+        await asyncio.gather(*(_send_report(uid, admin_text) for uid in targets),
+                             return_exceptions=True)
     except Exception:
-        pass
+        # detached from the update, so dp.errors never sees this
+        logger.exception("hidden reports for group %s failed", q.group_id)
 
 @dp.callback_query(F.data.startswith("open:"))
 async def open_whisper(call):
     token = call.data.split(":",1)[1]
-    async with SessionLocal() as s:
-        w = await s.get(Whisper, token)
-        if not w:
-            await call.answer("پیام یافت نشد.", show_alert=True); return
-        allowed = call.from_user.id in (w.sender_id, w.recipient_id)
-        if not allowed:
-            await call.answer("این نجوا برای شما نیست.", show_alert=True); return
-        await call.answer(w.text, show_alert=True)
-        if not w.read_at:
-            w.read_at = datetime.utcnow(); await s.commit()
-            try:
-                await bot.edit_message_text(
-                    chat_id=w.group_id,
-                    message_id=w.group_message_id,
-                    text=f"نجوا خوانده شد. فرستنده: <a href=\"tg://user?id={w.sender_id}\">کاربر</a>",
-                    reply_markup=whisper_button(w.id, again=True)
-                )
-            except Exception:
-                pass
-
-# -------- Admin-only (PRIVATE ONLY) --------
-def admin_only(func):
-    async def wrapper(message: Message, *a, **kw):
-        if message.chat.type != "private" or message.from_user.id != ADMIN_ID:
-            return
-        return await func(message, *a, **kw)
-    return wrapper
-
-@dp.message(F.chat.type == "private", F.text.lower().in_({"آمار","stats","/stats"}))
-@admin_only
-async def stats(message: Message):
-    async with SessionLocal() as s:
-        users = (await s.execute(select(User))).scalars().all()
-        groups = (await s.execute(select(Group))).scalars().all()
-        wcount = (await s.execute(select(Whisper))).scalars().all()
-    await message.answer(f"کاربران: {len(users)}\nگروه‌ها: {len(groups)}\nکل نجواها: {len(wcount)}")
-
-@dp.message(F.chat.type=="private", F.text.regexp(r"^بازکردن گزارش\s+(\-?\d+)\s+برای\s+(\-?\d+)$"))
-@admin_only
-async def open_watch(message: Message):
-    m = re.match(r"^بازکردن گزارش\s+(\-?\d+)\s+برای\s+(\-?\d+)$", message.text.strip())
-    gid = int(m.group(1)); uid = int(m.group(2))
-    async with SessionLocal() as s:
-        s.add(Watch(group_id=gid, user_id=uid)); await s.commit()
-    await message.answer("فعال شد.")
-
-@dp.message(F.chat.type=="private", F.text.regexp(r"^بستن گزارش\s+(\-?\d+)\s+برای\s+(\-?\d+)$"))
-@admin_only
-async def close_watch(message: Message):
-    m = re.match(r"^بستن گزارش\s+(\-?\d+)\s+برای\s+(\-?\d+)$", message.text.strip())
-    gid = int(m.group(1)); uid = int(m.group(2))
-    async with SessionLocal() as s:
-        await s.execute(delete(Watch).where(Watch.group_id==gid, Watch.user_id==uid)); await s.commit()
-    await message.answer("غیرفعال شد.")
+    uid = call.from_user.id
+    first_read = False
+    w = _read_whispers.get(token)
+    if w is None:
+        async with SessionLocal() as s:
+            # an allowed user's first tap marks the whisper read and fetches it in the same statement
+            w = (await s.execute(
+                update(Whisper)
+                .where(Whisper.id == token, Whisper.read_at.is_(None),
+                       or_(Whisper.recipient_id == uid, Whisper.sender_id == uid))
+                .values(read_at=datetime.utcnow())
+                .returning(*WHISPER_VIEW)
+            )).one_or_none()
+            first_read = w is not None
+            if not first_read:
+                w = (await s.execute(select(*WHISPER_VIEW).where(Whisper.id == token))).one_or_none()
+            await s.commit()
+    if not w:
+        await call.answer("پیام یافت نشد.", show_alert=True); return
+    if not can_read(uid, w):
+        await call.answer("این نجوا برای شما نیست.", show_alert=True); return
+    await call.answer(w.text, show_alert=True)
+    if first_read:
+        try:
+            await bot.edit_message_text(
+                chat_id=w.group_id,
+                message_id=w.group_message_id,
+                text=f"نجوا خوانده شد. فرستنده: <a href=\"tg://user?id={w.sender_id}\">کاربر</a>",
+                reply_markup=whisper_button(w.id, again=True)
+            )
+        except Exception:
+            pass
+    if w.read_at:
+        _read_whispers.set(token, w)
 
-@dp.message(F.chat.type=="private", F.text.lower().in_({"ارسال همگانی","broadcast","فوروارد همگانی"}))
-@admin_only
-async def broadcast_hint(message: Message):
-    await message.answer("پیامی که می‌خواهید فوروارد شود را Reply کنید و جمله «تایید ارسال» را بفرستید.")
+@dp.errors()
+async def on_error(event: ErrorEvent):
+    # blocked bots, deleted chats and stale buttons are routine; keep them out of the error log
+    exc = event.exception
+    if isinstance(exc, (TelegramBadRequest, TelegramForbiddenError)):
+        logger.info("telegram: %s", exc)
+    else:
+        logger.error("update %s failed", event.update.update_id, exc_info=exc)
+    return True
 
-@dp.message(F.chat.type=="private")
-@admin_only
-async def admin_private(message: Message):
-    if message.reply_to_message and message.text and message.text.strip() == "تایید ارسال":
-        reply = message.reply_to_message
-        sent = 0; failed = 0
-        async with SessionLocal() as s:
-            users = (await s.execute(select(User.id))).scalars().all()
-            groups = (await s.execute(select(Group.id))).scalars().all()
-        # FORWARD (not copy)
-        for uid in set(users):
-            try:
-                await reply.forward(uid)
-                sent += 1
-            except:
-                failed += 1
-        for gid in set(groups):
-            try:
-                await reply.forward(gid)
-                sent += 1
-            except:
-                failed += 1
-        await message.answer(f"فوروارد انجام شد. موفق: {sent} | ناموفق: {failed}")
+@dp.shutdown()
+async def drain_reports():
+    # runs before start_polling closes the bot session, so in-flight reports can still send
+    await asyncio.gather(*_report_tasks, return_exceptions=True)
 
 async def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
     await init_db()
-    print("Bot is running with polling...")
-    await dp.start_polling(bot)
+    await warm_pool()
+    sweeper = asyncio.create_task(sweep_pendings())
+    logger.info("Bot is running with polling...")
+    try:
+        await dp.start_polling(bot)
+    finally:
+        sweeper.cancel()
+        await close_db()
 
 if __name__ == "__main__":
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:  # e.g. Windows, where uvloop is unavailable
+        pass
     asyncio.run(main())
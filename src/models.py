@@ -1,8 +1,12 @@
 from datetime import datetime
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import ForeignKey, BigInteger, String, Text, Boolean, DateTime
+from sqlalchemy import ForeignKey, BigInteger, String, Text, Boolean, DateTime, Index, text
 from .database import Base
 
+# 16 hex chars / 64 bits: plenty for a key that is also checked against sender/recipient,
+# and short enough to keep the PK btree and the "open:<token>" callback_data small
+WHISPER_TOKEN_SQL = "left(md5(gen_random_uuid()::text), 16)"  # gen_random_uuid is built in since PostgreSQL 13
+
 class User(Base):
     __tablename__ = "users"
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
@@ -17,10 +21,13 @@ class Group(Base):
     title: Mapped[str | None] = mapped_column(String(255))
     active: Mapped[bool] = mapped_column(Boolean, default=True)
     last_seen: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # broadcasts only read active groups; keep that list in a small index of its own
+    __table_args__ = (Index("ix_groups_active", "id", postgresql_where=text("active")),)
 
 class Whisper(Base):
     __tablename__ = "whispers"
-    id: Mapped[str] = mapped_column(String(64), primary_key=True)  # token/uuid
+    # token is generated server-side and handed back via INSERT ... RETURNING
+    id: Mapped[str] = mapped_column(String(64, collation="C"), primary_key=True, server_default=text(WHISPER_TOKEN_SQL))
     group_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("groups.id", ondelete="CASCADE"))
     sender_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.id", ondelete="CASCADE"))
     recipient_id: Mapped[int] = mapped_column(BigInteger)
@@ -31,6 +38,8 @@ class Whisper(Base):
 
 class Pending(Base):
     __tablename__ = "pendings"
+    # short-lived hand-off state: not worth a WAL write, losing it on a crash just means re-triggering
+    __table_args__ = {"prefixes": ["UNLOGGED"]}
     sender_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
     recipient_id: Mapped[int] = mapped_column(BigInteger)
     group_id: Mapped[int] = mapped_column(BigInteger)
@@ -42,3 +51,5 @@ class Watch(Base):
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     group_id: Mapped[int] = mapped_column(BigInteger)
     user_id: Mapped[int] = mapped_column(BigInteger)
+    # report_targets reads user_id by group_id: answered from the index alone; unique so re-opening is a no-op
+    __table_args__ = (Index("ux_watches_group_user", "group_id", "user_id", unique=True),)
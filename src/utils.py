@@ -1,7 +1,11 @@
+import html
+import time
+from collections import OrderedDict
+from functools import lru_cache
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from .config import BOT_USERNAME, READ_LIMIT_MINUTES
 
-def start_keyboard(force=False):
+def _build_start_keyboard(force):
     kb = []
     if force:
         kb.append([InlineKeyboardButton(text="✅ تایید عضویت", callback_data="check_sub")])
@@ -9,15 +13,75 @@ def start_keyboard(force=False):
     kb.append([InlineKeyboardButton(text="🆘 ارتباط با پشتیبان", url="https://t.me/SOULSOWNERBOT")])
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
+# both variants are static: build them once and hand out the same (never mutated) markup
+_START_KEYBOARDS = {False: _build_start_keyboard(False), True: _build_start_keyboard(True)}
+
+def start_keyboard(force=False):
+    return _START_KEYBOARDS[bool(force)]
+
 def whisper_button(token: str, again: bool = False):
     text = "🔒 نمایش مجدد" if again else "🔒 نمایش پیام"
     kb = [[InlineKeyboardButton(text=text, callback_data=f"open:{token}")]]
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
-TRIGGERS = {"درگوشی", "نجوا", "سکرت"}
+@lru_cache(maxsize=1024)
+def esc(s: str) -> str:
+    # for names and chat titles, which repeat constantly; escape message bodies with html.escape directly
+    return html.escape(s)
+
+@lru_cache(maxsize=4096)
+def mention(uid: int, name: str) -> str:
+    return f'<a href="tg://user?id={uid}">{esc(name)}</a>'
+
+TRIGGERS = frozenset({"درگوشی", "نجوا", "سکرت"})
+# triggers have no cased letters, so lower() can never turn a miss into a hit; only "/" needs stripping
+_TRIGGER_STRIP = str.maketrans("", "", "/")
+# first character a trigger can start with; rejects nearly all chat traffic before any copying
+_TRIGGER_HEADS = frozenset({"/"} | {w[0] for w in TRIGGERS})
 
 def is_trigger(text: str) -> bool:
     if not text:
         return False
-    t = text.strip().lower().replace("/", "")
-    return t in TRIGGERS
+    # look at the first non-space character without copying: only whitespace-led text pays for lstrip()
+    i = len(text) - len(text.lstrip()) if text[0].isspace() else 0
+    if i == len(text) or text[i] not in _TRIGGER_HEADS:
+        return False
+    return text.strip().translate(_TRIGGER_STRIP) in TRIGGERS
+
+def command_in(*aliases: str):
+    # filter predicate for fixed commands: cheap length gate, exact hit, and lower() only for ASCII-case variants
+    names = frozenset(a.lower() for a in aliases)
+    longest = max(map(len, names))
+    def check(text: str | None) -> bool:
+        if not text or len(text) > longest:
+            return False
+        return text in names or text.lower() in names
+    return check
+
+class TTLCache:
+    """Tiny in-process LRU cache whose entries expire ``ttl`` seconds after being set."""
+
+    def __init__(self, ttl: float, maxsize: int = 10_000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        value, expires = item
+        if expires < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl: float | None = None):
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        self._data.pop(key, None)